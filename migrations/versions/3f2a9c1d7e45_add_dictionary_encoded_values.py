@@ -0,0 +1,63 @@
+"""add dictionary-encoded values
+
+Adds the per-journal 'values' table, 'contents.value_id' (indexed) and 'fields.encoded'.
+Databases created before this revision have no version stamp, so upgrade them with 'flask db upgrade'
+directly. Each step is skipped when db.create_all() has already applied it.
+
+Revision ID: 3f2a9c1d7e45
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7e45'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _columns(inspector, table):
+    return [c['name'] for c in inspector.get_columns(table)]
+
+
+def _indexes(inspector, table):
+    return [i['name'] for i in inspector.get_indexes(table)]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    if 'values' not in tables:
+        op.create_table('values',
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('journal_id', sa.Integer(), nullable=False),
+                        sa.Column('value', sa.String(), nullable=False),
+                        sa.ForeignKeyConstraint(['journal_id'], ['journals.id'], ),
+                        sa.PrimaryKeyConstraint('id'),
+                        sa.UniqueConstraint('journal_id', 'value')
+                        )
+    if 'fields' in tables and 'encoded' not in _columns(inspector, 'fields'):
+        with op.batch_alter_table('fields', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('encoded', sa.Boolean(), nullable=False, server_default=sa.false()))
+    if 'contents' in tables and 'value_id' not in _columns(inspector, 'contents'):
+        with op.batch_alter_table('contents', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('value_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_contents_value_id_values', 'values', ['value_id'], ['id'])
+    if 'contents' in tables and 'ix_contents_value_id' not in _indexes(inspector, 'contents'):
+        op.create_index('ix_contents_value_id', 'contents', ['value_id'], unique=False)
+
+
+def downgrade():
+    # Restore plain contents before the value table is dropped
+    op.execute('UPDATE contents SET content = (SELECT "values".value FROM "values" '
+               'WHERE "values".id = contents.value_id) WHERE value_id IS NOT NULL')
+    op.drop_index('ix_contents_value_id', table_name='contents')
+    with op.batch_alter_table('contents', schema=None) as batch_op:
+        batch_op.drop_column('value_id')
+    with op.batch_alter_table('fields', schema=None) as batch_op:
+        batch_op.drop_column('encoded')
+    op.drop_table('values')
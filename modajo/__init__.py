@@ -48,7 +48,7 @@ def create_app(configuration: str = None):
     # Initialize extensions
     _app.logger.info('Initializing extensions...')
     db.init_app(_app)
-    migrate.init_app(_app)
+    migrate.init_app(_app, db)
 
     _app.logger.info('Creating new tables, as necessary...')
     with _app.app_context():
@@ -61,5 +61,7 @@ def create_app(configuration: str = None):
 
         _app.logger.info('modajo has been successfully initialized!')
 
+    return _app
+
 if __name__ == "__main__":
     pass
@@ -1,8 +1,8 @@
 from flask import current_app
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, func, false, literal
 
 from modajo import db
-from modajo.models import Journal, Field
+from modajo.models import Journal, Field, Record, Content, Value, FieldView, RecordView, ContentView
 
 # FIELDTYPES = {  # TODO definitions need improvement (Python types?)
 #     'integer': {},
@@ -60,6 +60,13 @@ COMPOUND_TYPES = [
 
 FIELDTYPES = PRIMITIVE_TYPES + COMPOUND_TYPES
 
+ENCODABLE_TYPES = [  # Types whose contents can be dictionary-encoded into the value table
+    'string',
+    'tag',
+]
+
+BATCH_SIZE = 1000  # Rows fetched per round trip when streaming read-only views
+
 
 #  TODO add logging for all of these functions
 def get_journal(handle: int | str):
@@ -316,7 +323,8 @@ def create_primitive_field(journal: str | int | Journal,
                            visible: bool = True,
                            multiple_allowed: bool = False,
                            length: int = None,
-                           resolution: str = None):
+                           resolution: str = None,
+                           encoded: bool = False):
     """
     Creates a journal field\n
     Fieldtype must be one of PRIMITIVE_TYPES
@@ -329,6 +337,7 @@ def create_primitive_field(journal: str | int | Journal,
     :param multiple_allowed: whether the field can have multiple entries per record
     :param length: the maximum length of the field (only applies to STRING_TYPES). -1 indicates "unlimited"
     :param resolution: the smallest unit of time measured (only applies to TIME_TYPES)
+    :param encoded: whether contents are stored once per journal in the value table (only applies to ENCODABLE_TYPES)
     :return: a JournalField object
     """
     # Check existence, types and constraints
@@ -342,7 +351,7 @@ def create_primitive_field(journal: str | int | Journal,
         raise ValueError(f'\'{fieldtype}\' is not of type {", ".join([f"\'{x}\'" for x in PRIMITIVE_TYPES])}')
     if group is not None and not isinstance(group, Field): # Get JournalField object, if needed
         group = get_field(group, journal)
-    for n, a in dict(visible=visible, multiple_allowed=multiple_allowed).items(): # Check type
+    for n, a in dict(visible=visible, multiple_allowed=multiple_allowed, encoded=encoded).items(): # Check type
         if not isinstance(a, bool):
             raise TypeError(f'\'{n}\' must be of type bool')
     if length is not None:  # Check type and value
@@ -355,6 +364,8 @@ def create_primitive_field(journal: str | int | Journal,
             raise TypeError(f'\'resolution\' must be if type str')
         if resolution not in RESOLUTIONS:
             raise TypeError(f'\'{resolution}\' is not an accepted time unit resolution')
+    if encoded and fieldtype not in ENCODABLE_TYPES:  # Check fieldtype supports encoding
+        raise ValueError(f'Fields of type \'{fieldtype}\' cannot be encoded')
 
     # Create field, add to database and return
     field = Field()
@@ -370,6 +381,7 @@ def create_primitive_field(journal: str | int | Journal,
     if field in STRING_TYPES and not length:
         length = -1
     field.length = length
+    field.encoded = encoded
     db.session.add(field)
     db.session.commit()
     return field
@@ -432,3 +444,240 @@ def create_attachment_field(fieldname,
     :param multiple_allowed:
     :return:
     """
+
+
+def iter_records(journal: str | int | Journal, trash: bool = None, batch_size: int = BATCH_SIZE):
+    """
+    Streams the records of a journal as read-only RecordView tuples.\n
+    Rows are read with Core column selects, so no Record objects are created or added to the session.
+    Use this for listing and exporting, and get the Record object when it must be modified.
+    :param journal: the journal the records belong to
+    :param trash: whether the records are marked "trash"
+    :param batch_size: the number of rows fetched from the database at a time
+    :return: a generator of RecordView objects
+    """
+    if not isinstance(journal, Journal):
+        journal = get_journal(journal)
+    stmt = db.select(*[getattr(Record, c) for c in RecordView._fields]).where(Record.journal_id == journal.id)
+    if trash is not None:
+        stmt = stmt.where(Record.trash == trash)
+    stmt = stmt.order_by(Record.id).execution_options(yield_per=batch_size)
+    for row in db.session.execute(stmt):
+        yield RecordView._make(row)
+
+
+def iter_contents(journal: str | int | Journal,
+                  field: str | int | Field = None,
+                  record: int | Record = None,
+                  value: str = None,
+                  trash: bool = None,
+                  batch_size: int = BATCH_SIZE):
+    """
+    Streams the contents of a journal as read-only ContentView tuples.\n
+    Rows are read with Core column selects, so no Content objects are created or added to the session.
+    Contents of encoded fields are decoded, and each field's FieldView is read once and shared by its contents.
+    :param journal: the journal the contents belong to
+    :param field: the field the contents belong to, if any
+    :param record: the record (or record id) the contents belong to, if any
+    :param value: the exact content to match, if any
+    :param trash: whether the contents are marked "trash"
+    :param batch_size: the number of rows fetched from the database at a time
+    :return: a generator of ContentView objects
+    """
+    if not isinstance(journal, Journal):
+        journal = get_journal(journal)
+    decoded = func.coalesce(Value.value, Content.content).label('content')
+    columns = [decoded if c == 'content' else getattr(Content, c) for c in ContentView._fields if c != 'field']
+    fields_stmt = db.select(*[getattr(Field, c) for c in FieldView._fields]).where(Field.journal_id == journal.id)
+    stmt = db.select(*columns).outerjoin(Value, Content.value_id == Value.id).where(Content.journal_id == journal.id)
+    if field is not None:
+        if isinstance(field, int):  # Field ids are unique across journals
+            field = get_field(field)
+        elif not isinstance(field, Field):
+            field = get_field(field, journal)
+        if field.journal_id != journal.id:
+            raise ValueError(f'Field \'{field.fieldname}\' is not part of journal \'{journal.name}\'')
+        stmt = stmt.where(Content.field_id == field.id)
+        fields_stmt = fields_stmt.where(Field.id == field.id)
+    if record is not None:
+        stmt = stmt.where(Content.record_id == (record.id if isinstance(record, Record) else record))
+    if value is not None and field is not None and field.encoded:  # Compare value ids instead of text
+        value_id = _find_value(journal, value)
+        stmt = stmt.where(Content.value_id == value_id if value_id is not None else false())
+    elif value is not None and field is not None:
+        stmt = stmt.where(Content.content == value)
+    elif value is not None:  # Match plain and encoded contents without filtering on the decoded column
+        value_id = _find_value(journal, value)
+        if value_id is not None:
+            stmt = stmt.where(or_(Content.content == value, Content.value_id == value_id))
+        else:
+            stmt = stmt.where(Content.content == value)
+    if trash is not None:
+        stmt = stmt.where(Content.trash == trash)
+    stmt = stmt.order_by(Content.record_id, Content.id).execution_options(yield_per=batch_size)
+    fields = {row.id: FieldView._make(row) for row in db.session.execute(fields_stmt)}
+    for row in db.session.execute(stmt):
+        yield ContentView(*row, fields[row.field_id])
+
+
+def _find_value(journal: Journal, value: str):
+    """
+    Gets the id of a value in a journal's value table
+    :param journal: the journal the value belongs to
+    :param value: the value to look up
+    :return: the id of the value, or None if it is not stored
+    """
+    stmt = db.select(Value.id).where(and_(Value.journal_id == journal.id, Value.value == value))
+    return db.session.scalar(stmt)
+
+
+def _intern_value(journal: Journal, value: str):
+    """
+    Gets a value from a journal's value table, adding the value if it is not stored yet
+    :param journal: the journal the value belongs to
+    :param value: the value to intern
+    :return: a Value object
+    """
+    stmt = db.select(Value).where(and_(Value.journal_id == journal.id, Value.value == value))
+    stored: Value | None = db.session.scalar(stmt)
+    if stored is None:
+        stored = Value()
+        stored.journal = journal
+        stored.value = value
+        db.session.add(stored)
+        db.session.flush()
+    return stored
+
+
+def prune_values(journal: str | int | Journal, value_ids: list[int] = None):
+    """
+    Deletes the values of a journal that are no longer referenced by any content. Does not commit.\n
+    Call this after deleting contents of encoded fields.
+    :param journal: the journal whose value table is pruned
+    :param value_ids: the ids of the values to check (all values of the journal if not supplied)
+    """
+    if not isinstance(journal, Journal):
+        journal = get_journal(journal)
+    db.session.flush()
+    used = db.select(Content.id).where(Content.value_id == Value.id).exists()
+    stmt = db.delete(Value).where(and_(Value.journal_id == journal.id, ~used))
+    if value_ids is not None:
+        stmt = stmt.where(Value.id.in_(value_ids))
+    db.session.execute(stmt)
+
+
+def get_content_value(content: Content):
+    """
+    Gets the value of a content, decoding it if its field is encoded
+    :param content: a Content object
+    :return: the value of the content
+    """
+    if content.value_id is not None:
+        return content.value.value
+    return content.content
+
+
+def set_content_value(content: Content, value: str | None):
+    """
+    Sets the value of a content, encoding it if its field is encoded. Does not commit.\n
+    A value that is no longer used after the change is removed from the value table.
+    :param content: a Content object
+    :param value: the new value of the content
+    """
+    old_value_id = content.value_id
+    if content.field.encoded and value is not None:  # Assign the relationship too, so reads before a commit are current
+        content.value = _intern_value(content.journal, value)
+        content.value_id = content.value.id
+        content.content = None
+    else:
+        content.value = None
+        content.value_id = None
+        content.content = value
+    if old_value_id is not None and old_value_id != content.value_id:
+        prune_values(content.journal, [old_value_id])
+
+
+def create_content(record: int | Record,
+                   field: str | int | Field,
+                   value: str = None,
+                   parent: int | Content = None):
+    """
+    Creates a content for a record
+    :param record: the record (or record id) the content belongs to
+    :param field: the field the content belongs to
+    :param value: the value of the content
+    :param parent: the parent content (or content id), if any
+    :return: a Content object
+    """
+    if not isinstance(record, Record):
+        record = db.session.get(Record, record)
+        if not record:
+            raise ValueError('No record found')
+    if isinstance(field, int):  # Field ids are unique across journals
+        field = get_field(field)
+    elif not isinstance(field, Field):
+        field = get_field(field, record.journal)
+    if field.journal_id != record.journal_id:
+        raise ValueError(f'Field \'{field.fieldname}\' is not part of journal \'{record.journal.name}\'')
+    content = Content()
+    content.journal = record.journal
+    content.record = record
+    content.field = field
+    content.parent_id = parent.id if isinstance(parent, Content) else parent
+    content.trash = False
+    db.session.add(content)  # Add before encoding, as interning the value flushes the session
+    set_content_value(content, value)
+    db.session.commit()
+    return content
+
+
+def encode_field(field: str | int | Field, journal: str | int | Journal = None):
+    """
+    Converts the existing contents of a field in place to values in the journal's value table
+    :param field: the field to encode
+    :param journal: the journal the field is part of (optional if field id or Field object is supplied)
+    :return: a JournalField object
+    """
+    if not isinstance(field, Field):
+        field = get_field(field, journal)
+    if field.encoded:
+        return field
+    if field.fieldtype not in ENCODABLE_TYPES:
+        raise ValueError(f'Fields of type \'{field.fieldtype}\' cannot be encoded')
+    # Insert the distinct values not yet stored, then point every content at its value in one update
+    stored = db.select(Value.value).where(Value.journal_id == field.journal_id)
+    distinct = db.select(literal(field.journal_id), Content.content).where(and_(Content.field_id == field.id,
+                                                                               Content.content.is_not(None),
+                                                                               Content.content.not_in(stored)))
+    db.session.execute(db.insert(Value).from_select(['journal_id', 'value'], distinct.distinct()))
+    value_id = db.select(Value.id).where(and_(Value.journal_id == field.journal_id,
+                                              Value.value == Content.content)).scalar_subquery()
+    stmt = db.update(Content).where(and_(Content.field_id == field.id,
+                                         Content.content.is_not(None))).values(value_id=value_id, content=None)
+    db.session.execute(stmt)
+    field.encoded = True
+    db.session.commit()
+    current_app.logger.info(f'Encoded the field named \'{field.fieldname}\'')
+    return field
+
+
+def decode_field(field: str | int | Field, journal: str | int | Journal = None):
+    """
+    Converts the existing contents of an encoded field in place back to plain values
+    :param field: the field to decode
+    :param journal: the journal the field is part of (optional if field id or Field object is supplied)
+    :return: a JournalField object
+    """
+    if not isinstance(field, Field):
+        field = get_field(field, journal)
+    if not field.encoded:
+        return field
+    value = db.select(Value.value).where(Value.id == Content.value_id).scalar_subquery()
+    stmt = db.update(Content).where(and_(Content.field_id == field.id,
+                                         Content.value_id.is_not(None))).values(content=value, value_id=None)
+    db.session.execute(stmt)
+    prune_values(field.journal)
+    field.encoded = False
+    db.session.commit()
+    current_app.logger.info(f'Decoded the field named \'{field.fieldname}\'')
+    return field
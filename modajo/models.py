@@ -1,6 +1,6 @@
-from typing import List
+from typing import List, NamedTuple
 
-from sqlalchemy import ForeignKey, JSON
+from sqlalchemy import ForeignKey, JSON, UniqueConstraint, false
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from modajo import db
@@ -18,6 +18,7 @@ class Journal(db.Model):
     fields: Mapped[List['Field']] = relationship(back_populates='journal', cascade='all, delete')
     records: Mapped[List['Record']] = relationship(back_populates='journal', cascade='all, delete')
     contents: Mapped[List['Content']] = relationship(back_populates='journal', cascade='all, delete')
+    values: Mapped[List['Value']] = relationship(back_populates='journal', cascade='all, delete')
 
     def __repr__(self):
         return f'Journal(name={self.name}, enabled={self.enabled}, visible={self.visible}'
@@ -36,6 +37,7 @@ class Field(db.Model):
     multiple_allowed: Mapped[bool] = mapped_column(nullable=False, default=False)  # whether multiple records allowed per journal entry
     metadata: Mapped[JSON] = mapped_column(nullable=True)
     trash: Mapped[bool] = mapped_column(nullable=False)
+    encoded: Mapped[bool] = mapped_column(nullable=False, insert_default=False, server_default=false())  # whether contents are stored in the value table
 
     journal: Mapped['Journal'] = relationship(back_populates='fields')
     # TODO address issue where groupfield of type 'meta' is deleted but sub-fields are not (is there an issue?)
@@ -139,14 +141,56 @@ class Content(db.Model):
     parent_id: Mapped[int] = mapped_column(ForeignKey('contents.id'), nullable=True)
     content: Mapped[str] = mapped_column(nullable=True)
     trash: Mapped[bool] = mapped_column(nullable=False)
+    value_id: Mapped[int] = mapped_column(ForeignKey('values.id'), nullable=True, index=True)  # set instead of 'content' for encoded fields
 
     journal: Mapped['Journal'] = relationship(back_populates='contents')
     parent: Mapped['Content'] = relationship(back_populates='children')
     children: Mapped['Content'] = relationship(back_populates='parent')
     field: Mapped['Field'] = relationship(back_populates='contents')
     record: Mapped['Record'] = relationship(back_populates='contents')
+    value: Mapped['Value'] = relationship()
 
     def __repr__(self):
         return f'Contents(id={self.id}, journal={self.journal.name}'
 
 
+class Value(db.Model):
+    """A distinct content value shared by the contents of dictionary-encoded fields in a journal"""
+    __tablename__ = 'values'
+    __table_args__ = (UniqueConstraint('journal_id', 'value'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    journal_id: Mapped[int] = mapped_column(ForeignKey('journals.id'), nullable=False)
+    value: Mapped[str] = mapped_column(nullable=False)
+
+    journal: Mapped['Journal'] = relationship(back_populates='values')
+
+    def __repr__(self):
+        return f'Value(id={self.id}, journal={self.journal.name}, value={self.value}'
+
+
+# Read-only views of records and contents, built directly from result rows. They are plain tuples, so
+# they are never added to the session's identity map and carry no instrumentation or relationship state.
+# Each field is read once per query into a FieldView that every ContentView of that field shares.
+class FieldView(NamedTuple):
+    id: int
+    fieldname: str
+    fieldtype: str
+    displayname: str
+
+
+class RecordView(NamedTuple):
+    id: int
+    journal_id: int
+    trash: bool
+
+
+class ContentView(NamedTuple):
+    id: int
+    journal_id: int
+    field_id: int
+    record_id: int
+    parent_id: int | None
+    content: str | None
+    trash: bool
+    field: FieldView